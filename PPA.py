@@ -1,16 +1,33 @@
-from dataclasses import dataclass
-from typing import List, Dict, Set
+"""Parallel action planning: assign agents to dependent actions in stages.
+
+Performance notes:
+    The hot paths are plan_parallel_actions and validate_dependencies. Both are
+    interpreter- and memory-bound dict/list work over small DAGs (tens to
+    thousands of actions), not numeric kernels. Gains come from algorithmic
+    fixes (iterative DFS, a single topological pass, critical-path priority)
+    and data layout (slotted dataclasses, id-keyed maps). SIMD, GPU offload and
+    low-precision arithmetic have nothing to act on here. A compiled extension
+    (e.g. Cython) is only worth considering if profiling shows the scheduler
+    loop itself dominating.
+"""
+from dataclasses import dataclass, field
+from typing import List, Dict, Set, Tuple
 from collections import defaultdict
+import heapq
 
 # ----------------------------
 # Data model definitions
 # ----------------------------
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Agent:
     id: str
-    constraints: List[str]  # e.g., ["can't_attach"]
+    # e.g., ("can't_attach",); agent ids are unique, so equality and hashing use the id only.
+    constraints: Tuple[str, ...] = field(compare=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, "constraints", tuple(self.constraints))
 
-@dataclass
+@dataclass(slots=True)
 class Action:
     id: str
     type: str  # "fetch", "pick", "place", or "attach"
@@ -20,14 +37,14 @@ class Action:
     depends_on: List[str]  # IDs of actions this action depends on
     transfers_objects_to: List[str]  # (not used in this example)
 
-@dataclass
+@dataclass(slots=True)
 class ActionAssignment:
     action_id: str
     assigned_agents: List[Agent]
     stage: int
     description: str
 
-@dataclass
+@dataclass(slots=True)
 class PlanningResult:
     stages: Dict[int, List[ActionAssignment]]
     action_dependencies: Dict[str, List[str]]
@@ -35,52 +52,53 @@ class PlanningResult:
 # ----------------------------
 # Dependency validation
 # ----------------------------
-def validate_dependencies(actions: List[Action]) -> None:
-    action_ids = {a.id for a in actions}
+WHITE, GRAY, BLACK = 0, 1, 2  # unvisited, on the current DFS path, fully explored
+
+def validate_dependencies(actions: List[Action]) -> List[str]:
+    # Returns the action ids in topological order (every action after its dependencies).
+    by_id = {a.id: a for a in actions}
     for a in actions:
         for dep in a.depends_on:
-            if dep not in action_ids:
+            if dep not in by_id:
                 raise ValueError(f"Action {a.id} depends on non-existent action {dep}")
-    def has_cycle(aid: str, visited: Set[str], path: Set[str]) -> bool:
-        if aid in path:
-            return True
-        if aid in visited:
-            return False
-        visited.add(aid)
-        path.add(aid)
-        a = next(x for x in actions if x.id == aid)
-        for dep in a.depends_on:
-            if has_cycle(dep, visited, path):
-                return True
-        path.remove(aid)
-        return False
-    visited = set()
+    # Iterative three-color DFS: a GRAY child means a back edge, i.e. a cycle.
+    color = {a.id: WHITE for a in actions}
+    order: List[str] = []
     for a in actions:
-        if a.id not in visited:
-            if has_cycle(a.id, visited, set()):
+        if color[a.id] != WHITE:
+            continue
+        color[a.id] = GRAY
+        stack = [(a.id, iter(by_id[a.id].depends_on))]
+        while stack:
+            aid, deps = stack[-1]
+            dep = next(deps, None)
+            if dep is None:
+                color[aid] = BLACK
+                order.append(aid)
+                stack.pop()
+            elif color[dep] == GRAY:
                 raise ValueError(f"Cycle detected starting at {a.id}")
-
-# ----------------------------
-# Global tracking dictionaries
-# ----------------------------
-# For actions like fetch and attach we record the agent who last handled a given object.
-recent_handler: Dict[str, Agent] = {}
+            elif color[dep] == WHITE:
+                color[dep] = GRAY
+                stack.append((dep, iter(by_id[dep].depends_on)))
+    return order
 
 # ----------------------------
 # Helper functions
 # ----------------------------
-def get_free_agents(stage: int, stage_assignments: Dict[int, List[ActionAssignment]], available_agents: List[Agent]) -> List[Agent]:
+def get_free_agents(stage: int, stage_used_ids: List[Set[str]], available_agents: List[Agent]) -> List[Agent]:
     # In each stage, only agents not already assigned to an action are available.
-    used_ids = set()
-    for assignment in stage_assignments.get(stage, []):
-        for agent in assignment.assigned_agents:
-            used_ids.add(agent.id)
+    used_ids = stage_used_ids[stage] if stage < len(stage_used_ids) else ()
     return [agent for agent in available_agents if agent.id not in used_ids]
 
+def forbidden_action_types(agent: Agent) -> frozenset:
+    # Constraints of the form "can't_<type>" forbid the agent from that action type.
+    return frozenset(c[len("can't_"):] for c in agent.constraints if c.startswith("can't_"))
+
 def can_do_action(agent: Agent, action_type: str) -> bool:
-    return f"can't_{action_type}" not in agent.constraints
+    return action_type not in forbidden_action_types(agent)
 
-def update_object_tracking(action: Action, assigned: List[Agent]):
+def update_object_tracking(action: Action, assigned: List[Agent], recent_handler: Dict[str, Agent]):
     # For a fetch, record the agent who fetched the object; note that fetch frees the agent.
     if action.type == "fetch":
         for obj in action.objects:
@@ -94,39 +112,59 @@ def update_object_tracking(action: Action, assigned: List[Agent]):
 # Scheduling algorithm
 # ----------------------------
 def plan_parallel_actions(actions: List[Action], available_agents: List[Agent]) -> PlanningResult:
-    validate_dependencies(actions)
+    topo_order = validate_dependencies(actions)
+    agent_forbidden: Dict[str, frozenset] = {a.id: forbidden_action_types(a) for a in available_agents}
+    
+    by_id: Dict[str, Action] = {a.id: a for a in actions}
     
-    # Build reverse dependency graph and count dependents.
-    reverse_dependencies: Dict[str, List[Action]] = defaultdict(list)
+    # Build reverse dependency graph.
+    reverse_dependencies: Dict[str, List[str]] = defaultdict(list)  # action id -> dependent ids
     for a in actions:
         for dep in a.depends_on:
-            reverse_dependencies[dep].append(a)
-    dependency_count = {a.id: len(reverse_dependencies[a.id]) for a in actions}
+            reverse_dependencies[dep].append(a.id)
+    
+    # Critical-path length: number of actions on the longest chain starting at each action.
+    cp: Dict[str, int] = {}
+    for aid in reversed(topo_order):
+        cp[aid] = 1 + max((cp[cid] for cid in reverse_dependencies.get(aid, [])), default=0)
     
     assigned_actions: Dict[str, int] = {}  # action id -> stage number
-    stage_assignments: Dict[int, List[ActionAssignment]] = {}
-    unassigned_actions: Dict[str, Action] = {a.id: a for a in actions}
+    # For actions like fetch and attach we record the agent who last handled a given object.
+    recent_handler: Dict[str, Agent] = {}
+    # Stages are dense from 1, so both are indexed by stage number; index 0 is unused.
+    stage_assignments: List[List[ActionAssignment]] = [[]]
+    stage_used_ids: List[Set[str]] = [set()]  # agent ids already busy in each stage
+    
+    def ensure_stage(stage: int):
+        while len(stage_assignments) <= stage:
+            stage_assignments.append([])
+            stage_used_ids.append(set())
     
-    def schedule_task(task: Action, desired_stage: int):
+    def schedule_task(task: Action, desired_stage: int) -> int:
         stage = desired_stage
         while True:
-            free_agents = get_free_agents(stage, stage_assignments, available_agents)
-            free_agents = [agent for agent in free_agents if can_do_action(agent, task.type)]
+            free_agents = get_free_agents(stage, stage_used_ids, available_agents)
+            free_agents = [agent for agent in free_agents if task.type not in agent_forbidden[agent.id]]
             required_count = task.required_agents["min"]
             
             # Look for preferred candidates: agents who have recently handled one of the objects.
+            free_by_id = {agent.id: agent for agent in free_agents}
             preferred = []
+            preferred_ids: Set[str] = set()
             for obj in task.objects:
+                if len(preferred) >= required_count:
+                    break
                 if obj in recent_handler:
-                    agent = recent_handler[obj]
-                    if agent in free_agents and agent not in preferred:
-                        preferred.append(agent)
+                    aid = recent_handler[obj].id
+                    if aid in free_by_id and aid not in preferred_ids:
+                        preferred_ids.add(aid)
+                        preferred.append(free_by_id[aid])
             if len(preferred) >= required_count:
                 assigned = preferred[:required_count]
             else:
                 assigned = preferred[:]
                 # Fill with other available agents if needed.
-                others = [agent for agent in free_agents if agent not in assigned]
+                others = [agent for agent in free_agents if agent.id not in preferred_ids]
                 if len(assigned) + len(others) >= required_count:
                     assigned.extend(others[:required_count - len(assigned)])
                 else:
@@ -139,55 +177,60 @@ def plan_parallel_actions(actions: List[Action], available_agents: List[Agent])
                 stage=stage,
                 description=task.description
             )
-            stage_assignments.setdefault(stage, []).append(assignment)
+            ensure_stage(stage)
+            stage_assignments[stage].append(assignment)
+            stage_used_ids[stage].update(agent.id for agent in assigned)
             assigned_actions[task.id] = stage
-            if task.id in unassigned_actions:
-                del unassigned_actions[task.id]
-            update_object_tracking(task, assigned)
-            break
-        
-        # Recursively schedule child tasks.
-        children = reverse_dependencies.get(task.id, [])
-        children_sorted = sorted(children, key=lambda a: dependency_count[a.id], reverse=True)
-        for child in children_sorted:
-            if child.id in unassigned_actions and all(dep in assigned_actions for dep in child.depends_on):
-                schedule_task(child, stage + 1)
+            update_object_tracking(task, assigned, recent_handler)
+            return stage
+    
+    # Kahn-style topological pass: a task becomes ready the moment its last dependency is assigned.
+    indegree = {a.id: len(a.depends_on) for a in actions}
+    max_parent_stage: Dict[str, int] = defaultdict(int)  # relaxed as each dependency is assigned
+    position = {a.id: i for i, a in enumerate(actions)}  # final tie-breaker, keeps input order among equals
+    ready: List[tuple] = []
     
-    # First, schedule all head tasks that are of type "fetch".
-    root_tasks = [a for a in actions if not a.depends_on and a.type == "fetch"]
-    root_tasks_sorted = sorted(root_tasks, key=lambda a: dependency_count[a.id], reverse=True)
-    for task in root_tasks_sorted:
-        if task.id in unassigned_actions:
-            schedule_task(task, 1)
+    def push_ready(task: Action, desired_stage: int):
+        # Longest downstream chain first, then most immediate dependents.
+        dependent_count = len(reverse_dependencies.get(task.id, ()))
+        heapq.heappush(ready, (-cp[task.id], -dependent_count, position[task.id], desired_stage, task))
     
-    # Then schedule any remaining tasks.
-    while unassigned_actions:
-        available = [a for a in unassigned_actions.values() if all(dep in assigned_actions for dep in a.depends_on)]
-        if not available:
-            raise Exception("Unable to schedule tasks: " + str(list(unassigned_actions.keys())))
-        available_sorted = sorted(available, key=lambda a: dependency_count[a.id], reverse=True)
-        for task in available_sorted:
-            if task.id in unassigned_actions:
-                desired = (max(assigned_actions[dep] for dep in task.depends_on) + 1) if task.depends_on else 1
-                schedule_task(task, desired)
+    # First schedule all head tasks that are of type "fetch", then any other head tasks.
+    root_tasks = [a for a in actions if not a.depends_on]
+    fetch_roots = [a for a in root_tasks if a.type == "fetch"]
+    other_roots = [a for a in root_tasks if a.type != "fetch"]
+    for seeds in (fetch_roots, other_roots):
+        for task in seeds:
+            push_ready(task, 1)
+        while ready:
+            _, _, _, desired, task = heapq.heappop(ready)
+            stage = schedule_task(task, desired)
+            for cid in reverse_dependencies.get(task.id, []):
+                max_parent_stage[cid] = max(max_parent_stage[cid], stage)
+                indegree[cid] -= 1
+                if indegree[cid] == 0:
+                    push_ready(by_id[cid], max_parent_stage[cid] + 1)
+    if len(assigned_actions) < len(by_id):
+        raise Exception("Unable to schedule tasks: " + str([aid for aid in by_id if aid not in assigned_actions]))
     return PlanningResult(
-        stages=stage_assignments,
+        stages={stage: stage_assignments[stage] for stage in range(1, len(stage_assignments))},
         action_dependencies={a.id: a.depends_on for a in actions}
     )
 
 def create_dag_visualization(result: PlanningResult) -> str:
-    out = ""
-    max_stage = max(result.stages.keys()) if result.stages else 0
+    parts: List[str] = []
+    max_stage = max(result.stages, default=0)
     for stage in range(1, max_stage + 1):
-        out += f"Stage {stage}:\n"
+        parts.append(f"Stage {stage}:\n")
         for assignment in result.stages.get(stage, []):
-            agents_str = "[" + ",".join(a.id for a in assignment.assigned_agents) + "]"
-            out += f"    {assignment.action_id} {agents_str} - {assignment.description}\n"
+            agents_str = ",".join(a.id for a in assignment.assigned_agents)
+            parts.append(f"    {assignment.action_id} [{agents_str}] - {assignment.description}\n")
             deps = result.action_dependencies.get(assignment.action_id, [])
             if deps:
-                out += f"         depends on: {', '.join(deps)}\n"
-        out += "\n"
-    return out
+                deps_str = ", ".join(deps)
+                parts.append(f"         depends on: {deps_str}\n")
+        parts.append("\n")
+    return "".join(parts)
 
 # ----------------------------
 # Example: The Chair Assembly